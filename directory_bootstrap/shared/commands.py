@@ -5,6 +5,7 @@ import errno
 import os
 import subprocess
 import time
+from concurrent.futures import ThreadPoolExecutor
 
 COMMAND_BLKID = 'blkid'
 COMMAND_BLOCKDEV = 'blockdev'
@@ -32,6 +33,7 @@ COMMAND_SED = 'sed'
 COMMAND_SHA512SUM = 'sha512sum'
 COMMAND_TAR = 'tar'
 COMMAND_TUNE2FS = 'tune2fs'
+COMMAND_UDEVADM = 'udevadm'
 COMMAND_UMOUNT = 'umount'
 COMMAND_UNAME = 'uname'
 COMMAND_UNSHARE = 'unshare'
@@ -55,17 +57,92 @@ def check_call__keep_trying(executor, cmd):
 			break
 
 
+# Keyed on (PATH, command) so that a changed $PATH invalidates prior results;
+# a value of None records a confirmed miss
+_find_command_cache = {}
+
+# One frozenset of entry names per PATH directory; unreadable and missing
+# directories are treated as empty
+_path_dir_listings = {}
+
+# Split result per PATH value, so the common case of an unchanged $PATH
+# re-uses a single tuple
+_path_dirs_of = {}
+
+
+def _split_path(path):
+    try:
+        path_dirs = _path_dirs_of[path]
+    except KeyError:
+        path_dirs = tuple(path.split(':'))
+        _path_dirs_of[path] = path_dirs
+    return path_dirs
+
+
+def _list_path_dir(path_dir):
+    try:
+        listing = _path_dir_listings[path_dir]
+    except KeyError:
+        try:
+            listing = frozenset(os.listdir(path_dir))
+        except OSError:
+            listing = frozenset()
+        _path_dir_listings[path_dir] = listing
+    return listing
+
+
 def find_command(command):
     assert not command.startswith('/')
 
-    dirs = os.environ['PATH'].split(':')
-    for _dir in dirs:
-        abs_path = os.path.join(_dir, command)
-        if os.path.exists(abs_path):
-            return abs_path
+    path = os.environ['PATH']
+    cache_key = (path, command)
+    try:
+        abs_path = _find_command_cache[cache_key]
+    except KeyError:
+        abs_path = None
+        for _dir in _split_path(path):
+            if command in _list_path_dir(_dir):
+                abs_path = os.path.join(_dir, command)
+                break
+        _find_command_cache[cache_key] = abs_path
+
+    if abs_path is None:
+        raise OSError(EXIT_COMMAND_NOT_FOUND, 'Command "%s" not found in PATH.' \
+            % command)
+
+    return abs_path
+
+
+def _prefetch_path_dir_listings(path_dirs):
+    to_list = [d for d in dict.fromkeys(path_dirs) if d not in _path_dir_listings]
+    if len(to_list) < 2:
+        return
+
+    with ThreadPoolExecutor(max_workers=min(32, len(to_list))) as pool:
+        for _ in pool.map(_list_path_dir, to_list):
+            pass
+
 
-    raise OSError(EXIT_COMMAND_NOT_FOUND, 'Command "%s" not found in PATH.' \
-        % command)
+def _resolve_commands_in_path(commands):
+    path = os.environ['PATH']
+    path_dirs = _split_path(path)
+    _prefetch_path_dir_listings(path_dirs)
+
+    remaining = set(commands)
+    found = {}
+    for _dir in path_dirs:
+        if not remaining:
+            break
+        for command in remaining & _list_path_dir(_dir):
+            found[command] = os.path.join(_dir, command)
+        remaining -= set(found)
+
+    # Seed the find_command memo (hits and misses alike) so later
+    # one-off lookups of the same commands skip the scan entirely
+    for command in commands:
+        _find_command_cache[(path, command)] = found.get(command)
+
+    return found
 
 
 def check_for_commands(messenger, commands_to_check_for):
@@ -73,18 +150,19 @@ def check_for_commands(messenger, commands_to_check_for):
 
     missing_files = []
     missing_commands = []
-    for command in sorted(set(c for c in commands_to_check_for if c is not None)):
+    commands = sorted(set(c for c in commands_to_check_for if c is not None))
+    abs_path_of_command = _resolve_commands_in_path(
+            [c for c in commands if not c.startswith('/')])
+
+    for command in commands:
         if command.startswith('/'):
             abs_path = command
             if not os.path.exists(abs_path):
                 missing_files.append(abs_path)
             continue
 
-        try:
-            abs_path = find_command(command)
-        except OSError as e:
-            if e.errno != EXIT_COMMAND_NOT_FOUND:
-                raise
+        abs_path = abs_path_of_command.get(command)
+        if abs_path is None:
             missing_commands.append(command)
             messenger.error('Checking for %s... NOT FOUND' % command)
         else:
@@ -0,0 +1,65 @@
+# Copyright (C) 2015 Sebastian Pipping <sebastian@pipping.org>
+# Licensed under AGPL v3 or later
+
+import os
+
+
+def write_file(abs_filename, content_bytes, mode=0o644):
+    """
+    Writes a small file through an unbuffered fd in a single write
+    syscall; the mode is applied unconditionally (i.e. not subject
+    to the umask)
+    """
+    fd = os.open(abs_filename, os.O_WRONLY | os.O_CREAT | os.O_TRUNC, mode)
+    try:
+        os.fchmod(fd, mode)
+        os.write(fd, content_bytes)
+    finally:
+        os.close(fd)
+
+
+def append_to_file(abs_filename, content_bytes, header_bytes=b'',
+        mode=0o644):
+    """
+    Appends to a small file through an unbuffered fd; the header is
+    only written when the file starts out empty
+    """
+    fd = os.open(abs_filename,
+            os.O_WRONLY | os.O_CREAT | os.O_APPEND, mode)
+    try:
+        if header_bytes and os.fstat(fd).st_size == 0:
+            content_bytes = header_bytes + content_bytes
+        os.write(fd, content_bytes)
+    finally:
+        os.close(fd)
+
+
+def write_file_atomically(abs_filename, content_bytes, mode=0o644):
+    """
+    Writes a small file in a single write syscall, through a sibling
+    temp file renamed over the target, so readers never observe a
+    half-written file; a target that already holds the exact content
+    is left untouched (e.g. the re-writes after directory bootstrap)
+    """
+    try:
+        with open(abs_filename, 'rb') as f:
+            if f.read() == content_bytes:
+                return
+    except OSError:
+        pass
+
+    abs_tmp_filename = abs_filename + '.tmp'
+    fd = os.open(abs_tmp_filename,
+            os.O_WRONLY | os.O_CREAT | os.O_TRUNC, mode)
+    try:
+        try:
+            os.write(fd, content_bytes)
+        finally:
+            os.close(fd)
+        os.rename(abs_tmp_filename, abs_filename)
+    except OSError:
+        try:
+            os.unlink(abs_tmp_filename)
+        except OSError:
+            pass
+        raise
@@ -1,9 +1,52 @@
 # Copyright (C) 2015 Sebastian Pipping <sebastian@pipping.org>
 # Licensed under AGPL v3 or later
 
+import errno
+import os
+from ctypes import CDLL, c_char_p, c_ulong, c_void_p, get_errno
+
 from directory_bootstrap.shared.commands import (
         COMMAND_UMOUNT, check_call__keep_trying)
 
+_MNT_DETACH = 0x00000002
+
+try:
+    _lib_c = CDLL('libc.so.6', use_errno=True)
+    _lib_c.mount.argtypes = [c_char_p, c_char_p, c_char_p, c_ulong, c_void_p]
+except OSError:
+    _lib_c = None
+
+
+def try_mounting_in_process(source, abs_target, fstype, options=None):
+    """
+    Issues the mount(2) syscall directly, saving a fork of /bin/mount;
+    returns False where libc is not available
+    (so that the caller can fall back to running mount)
+    """
+    if _lib_c is None:
+        return False
+
+    options_char_p = options.encode('utf-8') if options else None
+    ret = _lib_c.mount(source.encode('utf-8'), abs_target.encode('utf-8'),
+            fstype.encode('utf-8'), 0, options_char_p)
+    if ret:
+        _errno = get_errno() or errno.EPERM
+        raise OSError(_errno, 'Mounting "%s" at "%s" failed: %s'
+                % (source, abs_target, os.strerror(_errno)))
+    return True
+
+
+def try_unmounting_lazily_in_process(abs_path):
+    """
+    Issues umount2(2) with MNT_DETACH directly; returns False where libc
+    is not available or the call failed, so that the caller can fall back
+    to running umount
+    """
+    if _lib_c is None:
+        return False
+
+    return _lib_c.umount2(abs_path.encode('utf-8'), _MNT_DETACH) == 0
+
 
 def try_unmounting(executor, abs_path):
     cmd = [
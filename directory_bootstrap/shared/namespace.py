@@ -3,12 +3,16 @@
 
 import errno
 import os
-from ctypes import CDLL, c_char_p, c_int, cast, get_errno
+from ctypes import CDLL, c_char_p, c_int, c_ulong, c_void_p, get_errno
 
 _CLONE_NEWNS = 0x00020000
 _CLONE_NEWUTS = 0x04000000
 
+_MS_REC = 0x4000
+_MS_PRIVATE = 0x40000
+
 _lib_c = CDLL("libc.so.6", use_errno=True)
+_lib_c.mount.argtypes = [c_char_p, c_char_p, c_char_p, c_ulong, c_void_p]
 
 
 def unshare_current_process(messenger):
@@ -18,11 +22,19 @@ def unshare_current_process(messenger):
         _errno = get_errno() or errno.EPERM
         raise OSError(_errno, 'Unsharing Linux namespaces failed: ' + os.strerror(_errno))
 
+    # What util-linux unshare does by default: without making the tree
+    # private, mounts from the new namespace still propagate back to the
+    # host on systems whose root mount is shared (systemd default) and
+    # wake every mount-table watcher there
+    ret = _lib_c.mount(b'none', b'/', None, _MS_REC | _MS_PRIVATE, None)
+    if ret:
+        _errno = get_errno() or errno.EPERM
+        raise OSError(_errno, 'Making mounts private failed: ' + os.strerror(_errno))
+
 
 def set_hostname(hostname):
-    hostname_char_p = cast(hostname.encode('utf-8'), c_char_p)
-    hostname_len_size_t = _lib_c.strlen(hostname_char_p)
-    ret = _lib_c.sethostname(hostname_char_p, hostname_len_size_t)
+    hostname_bytes = hostname.encode('utf-8')
+    ret = _lib_c.sethostname(hostname_bytes, len(hostname_bytes))
     if ret:
         _errno = get_errno() or errno.EPERM
         raise OSError(_errno, 'Setting hostname failed: ' + os.strerror(_errno))
@@ -1,16 +1,24 @@
 # Copyright (C) 2015 Sebastian Pipping <sebastian@pipping.org>
 # Licensed under AGPL v3 or later
 
+import re
 
+from directory_bootstrap.shared.file_writing import write_file_atomically
+
+_NAMESERVER_LINES = re.compile(rb'(?m)^nameserver[^\r\n]*')
 
 
 def filter_copy_resolv_conf(messenger, abs_etc_resolv_conf, output_filename):
     messenger.info('Writing file "%s" (based on file "%s")...'
             % (output_filename, abs_etc_resolv_conf))
 
-    with open(abs_etc_resolv_conf) as input_f:
-        with open(output_filename, 'w') as output_f:
-            for l in input_f:
-                line = l.rstrip()
-                if line.startswith('nameserver'):
-                    print(line, file=output_f)
+    with open(abs_etc_resolv_conf, 'rb') as input_f:
+        content = input_f.read()
+
+    nameserver_lines = [line.rstrip()
+            for line in _NAMESERVER_LINES.findall(content)]
+    output_content = b'\n'.join(nameserver_lines)
+    if output_content:
+        output_content += b'\n'
+
+    write_file_atomically(output_filename, output_content)
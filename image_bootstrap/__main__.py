@@ -79,6 +79,7 @@ def _main__level_three(messenger, options):
             _abspath_or_none(options.scripts_dir_pre),
             _abspath_or_none(options.scripts_dir_chroot),
             _abspath_or_none(options.scripts_dir_post),
+            options.scripts_parallel,
             os.path.abspath(options.target_path),
             options.command_grub2_install,
             )
@@ -146,6 +147,11 @@ def _main__level_two():
         help='scripts to run during chrooting phase, in alphabetical order')
     script_dirs.add_argument('--scripts-post', dest='scripts_dir_post', metavar='DIRECTORY',
         help='scripts to run after chrooting phase, in alphabetical order')
+    script_dirs.add_argument('--scripts-parallel', dest='scripts_parallel',
+        default=False, action='store_true',
+        help='run pre-chroot and post-chroot scripts in parallel rather than '
+            'in alphabetical order; only safe for scripts free of mutual '
+            'ordering dependencies (default: disabled)')
 
     commands = parser.add_argument_group('command names')
     commands.add_argument('--grub2-install', metavar='COMMAND', dest='command_grub2_install',
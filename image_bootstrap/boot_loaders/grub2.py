@@ -3,10 +3,10 @@
 
 
 
-import errno
 import os
 
 from directory_bootstrap.shared.commands import COMMAND_CHROOT
+from directory_bootstrap.shared.file_writing import write_file
 
 BOOTLOADER__CHROOT_GRUB2__DEVICE = 'chroot-grub2-device'
 BOOTLOADER__CHROOT_GRUB2__DRIVE = 'chroot-grub2-drive'
@@ -66,11 +66,7 @@ class GrubTwoInstaller(object):
         use_device_map = self._bootloader_approach in _BOOTLOADER__ANY_GRUB2__DRIVE
 
         chroot_boot_grub = os.path.join(self._abs_mountpoint, 'boot', 'grub')
-        try:
-            os.makedirs(chroot_boot_grub, 0o755)
-        except OSError as e:
-            if e.errno != errno.EEXIST:
-                raise
+        os.makedirs(chroot_boot_grub, 0o755, exist_ok=True)
 
         if use_device_map:
             # Write device map just for being able to call grub-install
@@ -78,9 +74,8 @@ class GrubTwoInstaller(object):
             grub_drive = '(hd9999)'
             self._messenger.info('Writing device map to "%s" (mapping "%s" to "%s")...' \
                     % (abs_chroot_device_map, grub_drive, real_abs_target))
-            f = open(abs_chroot_device_map, 'w')
-            print('%s\t%s' % (grub_drive, real_abs_target), file=f)
-            f.close()
+            write_file(abs_chroot_device_map,
+                    ('%s\t%s\n' % (grub_drive, real_abs_target)).encode('utf-8'))
 
         self._messenger.info(message)
 
@@ -239,16 +239,17 @@ class ArchStrategy(DistroStrategy):
         self._install_packages(['openssh'])
 
     def _make_services_autostart(self, service_names):
-        for service_name in service_names:
-            self._messenger.info('Making service "%s" start automatically...' % service_name)
-            cmd = [
-                COMMAND_CHROOT,
-                self._abs_mountpoint,
-                'systemctl',
-                'enable',
-                service_name,
-                ]
-            self._executor.check_call(cmd, env=self.create_chroot_env())
+        self._messenger.info('Making services %s start automatically...'
+                % ', '.join('"%s"' % name for name in service_names))
+        # Offline systemctl parses the unit graph per invocation,
+        # so enable all services in one go
+        cmd = [
+            COMMAND_CHROOT,
+            self._abs_mountpoint,
+            'systemctl',
+            'enable',
+            ] + list(service_names)
+        self._executor.check_call(cmd, env=self.create_chroot_env())
 
     def make_openstack_services_autostart(self):
         self._make_services_autostart([
@@ -8,6 +8,7 @@ from abc import ABCMeta, abstractmethod
 
 import image_bootstrap.loaders._yaml as yaml
 from directory_bootstrap.shared.commands import COMMAND_WGET
+from directory_bootstrap.shared.file_writing import write_file_atomically
 from image_bootstrap.engine import BOOTLOADER__CHROOT_GRUB2__DRIVE
 
 DISTRO_CLASS_FIELD = 'distro_class'
@@ -30,6 +31,13 @@ class DistroStrategy(object, metaclass=ABCMeta):
     def create_chroot_env(self):
         return self._chroot_env_prototype.copy()
 
+    def get_chroot_env(self):
+        """
+        Read-only chroot environment for passing straight to subprocess
+        calls; use create_chroot_env() where the dict is to be mutated
+        """
+        return self._chroot_env_prototype
+
     def check_release(self):
         pass
 
@@ -39,9 +47,7 @@ class DistroStrategy(object, metaclass=ABCMeta):
     def write_etc_hostname(self, hostname):
         filename = os.path.join(self._abs_mountpoint, 'etc', 'hostname')
         self._messenger.info('Writing file "%s"...' % filename)
-        f = open(filename, 'w')
-        print(hostname, file=f)
-        f.close()
+        write_file_atomically(filename, (hostname + '\n').encode('utf-8'))
 
     @abstractmethod  # leave calling write_etc_hostname to derived classes
     def configure_hostname(self, hostname):
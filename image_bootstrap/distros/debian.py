@@ -13,6 +13,8 @@ class DebianStrategy(DebianBasedDistroStrategy):
     DEFAULT_RELEASE = 'stretch'
     DEFAULT_MIRROR_URL = 'http://httpredir.debian.org/debian'
     APT_CACHER_NG_URL = 'http://localhost:3142/debian'
+    CLOUD_INIT_PACKAGES = ('cloud-init', 'cloud-utils',
+            'cloud-initramfs-growroot')
 
     def check_release(self):
         if self._release in ('stable', 'testing'):
@@ -28,9 +30,6 @@ class DebianStrategy(DebianBasedDistroStrategy):
 
         return 'linux-image-%s' % architecture
 
-    def install_cloud_init_and_friends(self):
-        self._install_packages(['cloud-init', 'cloud-utils', 'cloud-initramfs-growroot'])
-
     def uses_systemd(self):
         return True
 
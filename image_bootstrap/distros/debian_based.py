@@ -10,7 +10,9 @@ from abc import ABCMeta, abstractmethod
 from textwrap import dedent
 
 from directory_bootstrap.shared.commands import (
-        COMMAND_FIND, COMMAND_UNAME, COMMAND_UNSHARE)
+        COMMAND_FIND, COMMAND_MOUNT, COMMAND_UNAME, COMMAND_UNSHARE)
+from directory_bootstrap.shared.mount import (
+        try_unmounting, try_unmounting_lazily_in_process)
 from image_bootstrap.distros.base import DISTRO_CLASS_FIELD, DistroStrategy
 from image_bootstrap.engine import (
         BOOTLOADER__ANY_GRUB, BOOTLOADER__HOST_EXTLINUX, COMMAND_CHROOT)
@@ -51,6 +53,7 @@ class DebianBasedDistroStrategy(DistroStrategy, metaclass=ABCMeta):
             mirror_url,
             command_debootstrap,
             debootstrap_opt,
+            abs_apt_cache_dir,
             ):
         self._messenger = messenger
         self._executor = executor
@@ -59,6 +62,9 @@ class DebianBasedDistroStrategy(DistroStrategy, metaclass=ABCMeta):
         self._mirror_url = mirror_url
         self._command_debootstrap = command_debootstrap
         self._debootstrap_opt = debootstrap_opt
+        self._abs_apt_cache_dir = abs_apt_cache_dir
+
+        self._pending_packages = []
 
     @abstractmethod
     def check_release(self):
@@ -187,39 +193,90 @@ class DebianBasedDistroStrategy(DistroStrategy, metaclass=ABCMeta):
     def perform_in_chroot_shipping_clean_up(self):
         pass  # nothing, yet
 
+    def _abs_chroot_apt_archives(self):
+        return os.path.join(self._abs_mountpoint,
+                'var', 'cache', 'apt', 'archives')
+
+    def prepare_installation_of_packages(self):
+        if self._abs_apt_cache_dir is None:
+            return
+
+        # Downloaded .deb files land in (and come back from) the host
+        # cache, so repeated builds skip the mirror entirely
+        self._messenger.info('Mounting host apt cache "%s" into the chroot...'
+                % self._abs_apt_cache_dir)
+        os.makedirs(self._abs_apt_cache_dir, 0o755, exist_ok=True)
+        self._executor.check_call([
+                COMMAND_MOUNT,
+                '--bind',
+                self._abs_apt_cache_dir,
+                self._abs_chroot_apt_archives(),
+                ])
+
     def perform_post_chroot_clean_up(self):
+        if self._abs_apt_cache_dir is not None:
+            # The cached .deb files belong to the host, not the image;
+            # the lazy detach cannot fail on a busy mount, so the clean
+            # below can never reach through into the host cache
+            abs_archives = self._abs_chroot_apt_archives()
+            if not try_unmounting_lazily_in_process(abs_archives):
+                try_unmounting(self._executor, abs_archives)
+
         self._messenger.info('Cleaning chroot apt cache...')
         cmd = [
                 COMMAND_FIND,
-                os.path.join(self._abs_mountpoint, 'var', 'cache', 'apt', 'archives'),
+                self._abs_chroot_apt_archives(),
                 '-type', 'f',
                 '-name', '*.deb',
                 '-delete',
                 ]
         self._executor.check_call(cmd)
 
+    def _queue_packages(self, package_names):
+        # Deferred until the next apt-get run, so that independent
+        # installs share one dpkg/trigger pass
+        self._pending_packages += [p for p in package_names
+                if p not in self._pending_packages]
+
     def _install_packages(self, package_names):
+        package_names = self._pending_packages + [p
+                for p in list(package_names)
+                if p not in self._pending_packages]
+        self._pending_packages = []
+
         self._messenger.info('Installing %s...' % ', '.join(package_names))
         env = self.create_chroot_env()
         env.setdefault('DEBIAN_FRONTEND', 'noninteractive')
+        env.setdefault('DEBCONF_NONINTERACTIVE_SEEN', 'true')
         cmd = [
                 COMMAND_CHROOT,
                 self._abs_mountpoint,
                 'apt-get',
+                # dpkg fsyncs after every unpacked file; pointless for an
+                # image that is only ever shipped as a whole
+                '-o', 'DPkg::Options::=--force-unsafe-io',
+                # Never stop for conffile questions; fresh images have no
+                # local modifications worth keeping anyway
+                '-o', 'DPkg::Options::=--force-confdef',
+                '-o', 'DPkg::Options::=--force-confold',
                 'install',
                 '-y', '--no-install-recommends', '-V',
-                ] + list(package_names)
+                ] + package_names
         self._executor.check_call(cmd, env=env)
 
     def install_dhcp_client(self):
         pass  # already installed
 
     def install_sudo(self):
-        self._install_packages(['sudo'])
+        # Picked up by the cloud-init install right after, saving one
+        # full apt/dpkg round trip
+        self._queue_packages(['sudo'])
 
-    @abstractmethod
     def install_cloud_init_and_friends(self):
-        pass
+        # The bundle is a class-level constant per distro, frozen at
+        # definition time, so callers (and the apt batching) can inspect
+        # it without running anything
+        self._install_packages(list(self.CLOUD_INIT_PACKAGES))
 
     def get_cloud_init_datasource_cfg_path(self):
         return '/etc/cloud/cloud.cfg.d/90_dpkg.cfg'  # existing file
@@ -268,6 +325,12 @@ class DebianBasedDistroStrategy(DistroStrategy, metaclass=ABCMeta):
                     'can be passed several times; '
                     'use with --debootstrap-opt=... syntax, i.e. with "="')
 
+        debian.add_argument('--apt-cache-dir', dest='apt_cache_dir',
+                metavar='DIRECTORY', default=None,
+                help='host directory to bind-mount over the chroot\'s '
+                    '/var/cache/apt/archives so that downloaded packages '
+                    'survive across runs (default: no persistent cache)')
+
     @classmethod
     def create(clazz, messenger, executor, options):
         return clazz(
@@ -277,4 +340,6 @@ class DebianBasedDistroStrategy(DistroStrategy, metaclass=ABCMeta):
                 options.mirror_url,
                 options.command_debootstrap,
                 options.debootstrap_opt,
+                options.apt_cache_dir
+                        and os.path.abspath(options.apt_cache_dir),
                 )
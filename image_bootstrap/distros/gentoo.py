@@ -3,16 +3,17 @@
 
 
 
-import errno
-import glob
 import os
 import platform
+import re
 import shutil
 from textwrap import dedent
 
 from directory_bootstrap.distros.gentoo import GentooBootstrapper
+from directory_bootstrap.shared.file_writing import (
+        append_to_file, write_file, write_file_atomically)
 from directory_bootstrap.shared.commands import (
-        COMMAND_CHROOT, COMMAND_FIND, COMMAND_WGET)
+        COMMAND_CHROOT, COMMAND_WGET)
 from image_bootstrap.distros.base import DISTRO_CLASS_FIELD, DistroStrategy
 
 _ABS_PACKAGE_USE = '/etc/portage/package.use'
@@ -20,6 +21,21 @@ _ABS_PACKAGE_KEYWORDS = '/etc/portage/package.accept_keywords'
 _ABS_PACKAGE_MASK = '/etc/portage/package.mask'
 _ABS_PACKAGE_UNMASK = '/etc/portage/package.unmask'
 
+_DHCPCD_MTU_LINE = re.compile(r'^[ \t]*#?[ \t]*option[ \t]+interface_mtu.*$',
+        re.M)
+
+_GRUB_TERMINAL_LINE = re.compile(r'^.*GRUB_TERMINAL=.*$', re.M)
+_GRUB_CMDLINE_COMMENTED = re.compile(r'#GRUB_CMDLINE_LINUX=.*"')
+
+_VERSION_CHUNKS = re.compile(r'\d+|\D+')
+
+
+def _version_sort_key(name):
+    # "vmlinuz-5.10.0" must beat "vmlinuz-5.9.0", which plain string
+    # ordering gets wrong; numeric chunks compare as numbers
+    return tuple((0, int(chunk)) if chunk.isdigit() else (1, chunk)
+            for chunk in _VERSION_CHUNKS.findall(name))
+
 _ARCH_OF_PLATFORM = {
     # TODO more arches here
     'x86_64': 'amd64',
@@ -29,11 +45,118 @@ _HOST_PLATFORM = platform.machine()
 _HOST_ARCH = _ARCH_OF_PLATFORM.get(_HOST_PLATFORM, _HOST_PLATFORM)
 
 
+def _get_job_count():
+    # Overridable for memory-constrained build hosts
+    try:
+        return max(1, int(os.environ['IMAGE_BOOTSTRAP_JOBS']))
+    except (KeyError, ValueError):
+        pass
+
+    if hasattr(os, 'sched_getaffinity'):  # i.e. respect cgroup limits
+        return max(2, len(os.sched_getaffinity(0)))
+    return max(2, os.cpu_count() or 2)
+
+
+_JOB_COUNT = _get_job_count()
+
+_ETC_CONF_D_HOSTNAME_CONTENT = dedent("""\
+        # Written by image-bootstrap
+        if [ -f /etc/hostname ]; then
+            hostname="`cat /etc/hostname`"
+        fi
+
+        if [ -z "${hostname}" ]; then
+            hostname=localhost
+        fi
+        """)
+
+_ETC_CONF_D_NET_CONTENT = dedent("""\
+        # Generated by image-bootstrap
+        modules="dhcpcd"
+        config_eth0="dhcp"
+        """)
+
+_SSHD_NEED_ROOT_CONTENT = dedent("""\
+        #!/sbin/runscript
+        # Workaround to ensure that sshd has a writable root file system
+        # during key generation
+        # https://bugs.gentoo.org/show_bug.cgi?id=554804
+        #
+        # Copyright (C) 2015 Sebastian Pipping <sebastian@pipping.org>
+        # Licensed under AGPL v3 or later
+
+        depend() {
+            if ! ls /etc/ssh/ssh_host_*_key 1>/dev/null 2>/dev/null; then
+                need root
+            fi
+            before sshd
+        }
+
+        start() { :; }
+        stop() { :; }
+        """)
+
+
+def _parse_kernel_config_tasks(tasks):
+    option_names = []
+    for line in tasks.split('\n'):
+        if not line or line.startswith('#'):
+            continue
+        assert line.startswith('CONFIG_')
+        assert line.endswith('=y')
+        option_names.append(line[len('CONFIG_'):-len('=y')])
+    return tuple(option_names)
+
+
+_KVM_KERNEL_OPTIONS = _parse_kernel_config_tasks(dedent("""\
+        # Based on https://git.kernel.org/pub/scm/linux/kernel/git/stable/linux.git/tree/kernel/configs/kvm_guest.config?h=v5.17.3
+        CONFIG_NET=y
+        CONFIG_NET_CORE=y
+        CONFIG_NETDEVICES=y
+        CONFIG_BLOCK=y
+        CONFIG_BLK_DEV=y
+        CONFIG_NETWORK_FILESYSTEMS=y
+        CONFIG_INET=y
+        CONFIG_TTY=y
+        CONFIG_SERIAL_8250=y
+        CONFIG_SERIAL_8250_CONSOLE=y
+        CONFIG_IP_PNP=y
+        CONFIG_IP_PNP_DHCP=y
+        CONFIG_BINFMT_ELF=y
+        CONFIG_PCI=y
+        CONFIG_PCI_MSI=y
+        # CONFIG_DEBUG_KERNEL=y
+        CONFIG_VIRTUALIZATION=y
+        CONFIG_HYPERVISOR_GUEST=y
+        CONFIG_PARAVIRT=y
+        CONFIG_KVM_GUEST=y
+        CONFIG_VIRTIO=y
+        CONFIG_VIRTIO_MENU=y
+        CONFIG_VIRTIO_PCI=y
+        CONFIG_VIRTIO_BLK=y
+        CONFIG_VIRTIO_CONSOLE=y
+        CONFIG_VIRTIO_NET=y
+        CONFIG_9P_FS=y
+        CONFIG_NET_9P=y
+        CONFIG_NET_9P_VIRTIO=y
+        CONFIG_SCSI_LOWLEVEL=y
+        CONFIG_SCSI_VIRTIO=y
+        CONFIG_VIRTIO_INPUT=y
+        CONFIG_DRM_VIRTIO_GPU=y
+        """))
+
+
 class GentooStrategy(DistroStrategy):
     DISTRO_KEY = 'gentoo'
     DISTRO_NAME_SHORT = 'Gentoo'
     DISTRO_NAME_LONG = 'Gentoo'
 
+    _COMMANDS_TO_CHECK_FOR = tuple(
+            GentooBootstrapper.get_commands_to_check_for()) + (
+            COMMAND_CHROOT,
+            COMMAND_WGET,
+            )
+
     def __init__(self, messenger, executor, abs_cache_dir,
                 mirror_url, max_age_days,
                 stage3_date_triple_or_none, repository_date_triple_or_none,
@@ -50,26 +173,23 @@ class GentooStrategy(DistroStrategy):
         self._stage3_date_triple_or_none = stage3_date_triple_or_none
         self._repository_date_triple_or_none = repository_date_triple_or_none
 
+        self._pending_package_atoms = []
+        self._installed_package_atoms = set()
+
+        self._installed_kernel_version = None
+
+        self._abs_package_use_dir = None
+        self._abs_package_keywords_dir = None
+        self._abs_package_mask_dir = None
+        self._abs_package_unmask_dir = None
+
     def _write_etc_conf_d_hostname(self):
         etc_conf_d = os.path.join(self._abs_mountpoint, 'etc/conf.d')
-        try:
-            os.makedirs(etc_conf_d, 0o755)
-        except OSError as e:
-            if e.errno != errno.EEXIST:
-                raise
+        os.makedirs(etc_conf_d, 0o755, exist_ok=True)
 
         etc_conf_d_hostname = os.path.join(etc_conf_d, 'hostname')
-        with open(etc_conf_d_hostname, 'w') as f:
-            print(dedent("""\
-                    # Written by image-bootstrap
-                    if [ -f /etc/hostname ]; then
-                        hostname="`cat /etc/hostname`"
-                    fi
-
-                    if [ -z "${hostname}" ]; then
-                        hostname=localhost
-                    fi
-                    """), file=f)
+        write_file(etc_conf_d_hostname,
+                _ETC_CONF_D_HOSTNAME_CONTENT.encode('utf-8'))
 
     def configure_hostname(self, hostname):
         self.write_etc_hostname(hostname)
@@ -81,79 +201,86 @@ class GentooStrategy(DistroStrategy):
     def _patch_etc_dhcpcd_conf(self, use_mtu):
         etc_dhcpcd_conf = os.path.join(self._abs_mountpoint, 'etc/dhcpcd.conf')
         with open(etc_dhcpcd_conf) as f:
-            input_lines = f.read().split('\n')
+            content = f.read()
 
-        ENABLED = 'option interface_mtu'
-        DISABLED = '#option interface_mtu'
+        replacement = ('option interface_mtu' if use_mtu
+                else '#option interface_mtu')
+        content, match_count = _DHCPCD_MTU_LINE.subn(replacement, content)
+        if not match_count:
+            if content and not content.endswith('\n'):
+                content += '\n'
+            content += replacement + '\n'
 
-        output_lines = []
-        configured = False
-        for l in input_lines:
-            if 'option interface_mtu' in l:
-                commented_out = l.lstrip().startswith('#')
-                if commented_out and use_mtu:
-                    l = ENABLED
-                elif not commented_out and not use_mtu:
-                    l = DISABLED
-                configured = True
-            output_lines.append(l)
-
-        if not configured:
-            output_lines.append(ENABLED if use_mtu else DISABLED)
-
-        with open(etc_dhcpcd_conf, 'w') as f:
-            print('\n'.join(output_lines), file=f)
+        write_file_atomically(etc_dhcpcd_conf, content.encode('utf-8'))
 
     def create_network_configuration(self, use_mtu_tristate):
         etc_conf_d_net = os.path.join(self._abs_mountpoint, 'etc/conf.d/net')
-        with open(etc_conf_d_net, 'w') as f:
-            print(dedent("""\
-                    # Generated by image-bootstrap
-                    modules="dhcpcd"
-                    config_eth0="dhcp"
-                    """), file=f)
+        write_file(etc_conf_d_net, _ETC_CONF_D_NET_CONTENT.encode('utf-8'))
 
         if use_mtu_tristate is not None:
             self._patch_etc_dhcpcd_conf(use_mtu_tristate)
 
+    def _append_package_config(self, abs_dir, line):
+        # One aggregated file per category keeps portage's own directory
+        # scans short, instead of one file per package atom
+        append_to_file(os.path.join(abs_dir, 'image-bootstrap'),
+                (line + '\n').encode('utf-8'),
+                header_bytes=b'# generated by image-bootstrap\n')
+
     def _set_package_use_flags(self, package_name, flags_str, package_atom=None):
         if package_atom is None:
             package_atom = package_name
 
-        filename = os.path.join(self._abs_mountpoint, _ABS_PACKAGE_USE.lstrip('/'), package_name.replace('/', '--'))
-        with open(filename, 'w') as f:
-            print('# generated by image-bootstrap', file=f)
-            print('%s %s' % (package_atom, flags_str), file=f)
+        self._append_package_config(self._abs_package_use_dir,
+                '%s %s' % (package_atom, flags_str))
 
     def _set_package_keywords(self, package_name, keywords_str, package_atom=None):
         if package_atom is None:
             package_atom = package_name
 
-        filename = os.path.join(self._abs_mountpoint,
-                _ABS_PACKAGE_KEYWORDS.lstrip('/'),
-                package_name.replace('/', '--'),
-                )
-        with open(filename, 'w') as f:
-            print('# generated by image-bootstrap', file=f)
-            print('%s %s' % (package_atom, keywords_str), file=f)
+        self._append_package_config(self._abs_package_keywords_dir,
+                '%s %s' % (package_atom, keywords_str))
 
     def _add_package_mask(self, package_name, package_atom=None, invert=False):
         if package_atom is None:
             package_atom = package_name
 
-        filename = os.path.join(self._abs_mountpoint,
-                (_ABS_PACKAGE_UNMASK if invert else _ABS_PACKAGE_MASK).lstrip('/'),
-                package_name.replace('/', '--'),
-                )
-        with open(filename, 'w') as f:
-            print('# generated by image-bootstrap', file=f)
-            print(package_atom, file=f)
+        self._append_package_config(
+                self._abs_package_unmask_dir if invert
+                        else self._abs_package_mask_dir,
+                package_atom)
+
+    def _queue_package_atoms(self, packages):
+        # Deferred until the next emerge, so that independent installs
+        # share a single run of the portage resolver
+        self._pending_package_atoms += [p for p in packages
+                if p not in self._pending_package_atoms]
+
+    def _flush_package_atoms(self):
+        if self._pending_package_atoms:
+            self._install_package_atoms([])
 
     def _install_package_atoms(self, packages, reinstall=False):
-        env = self.create_chroot_env().update({
-            'DONT_MOUNT_BOOT': '1',  # sys-boot/grub
-            'MAKEOPTS': '-j2',
-        })
+        if self._pending_package_atoms:
+            if reinstall:
+                self._flush_package_atoms()  # different emerge options
+            else:
+                packages = self._pending_package_atoms + [p
+                        for p in list(packages)
+                        if p not in self._pending_package_atoms]
+                self._pending_package_atoms = []
+
+        if not reinstall:
+            # Atoms emerged earlier this run would only cost another
+            # full dependency resolution for a guaranteed no-op
+            packages = [p for p in packages
+                    if p not in self._installed_package_atoms]
+            if not packages:
+                return
+
+        env = dict(self.get_chroot_env(),
+                DONT_MOUNT_BOOT='1',  # sys-boot/grub
+                MAKEOPTS='-j%d' % _JOB_COUNT)
         argv = [
             COMMAND_CHROOT,
             self._abs_mountpoint,
@@ -164,13 +291,14 @@ class GentooStrategy(DistroStrategy):
             '--tree',
             '--verbose',
             '--verbose-conflicts',
-            '--jobs', '2',
+            '--jobs', str(_JOB_COUNT),
         ]
         if not reinstall:
             argv += ['--update', '--changed-use']
         argv += list(packages)
 
         self._executor.check_call(argv, env=env)
+        self._installed_package_atoms.update(packages)
 
     def ensure_chroot_has_grub2_installed(self):
         self._set_package_use_flags(
@@ -179,57 +307,81 @@ class GentooStrategy(DistroStrategy):
                 'sys-fs/lvm2', '-thin')
         self._install_package_atoms(['sys-boot/grub:2'])
 
-    def _disable_grub2_gfxmode(self):
-        self._executor.check_call([
-                COMMAND_CHROOT, self._abs_mountpoint,
-                'sed',
-                '/GRUB_TERMINAL=/ s,.*GRUB_TERMINAL=.*,GRUB_TERMINAL=console  # forced by image-bootstrap,',
-                '-i', '/etc/default/grub',
-                ], env=self.create_chroot_env())
-
-    def _ensure_eth0_naming(self):
-        self._executor.check_call([
-                COMMAND_CHROOT, self._abs_mountpoint,
-                'sed',
-                's,#GRUB_CMDLINE_LINUX=.*",GRUB_CMDLINE_LINUX="net.ifnames=0"  # set by image-bootstrap,',
-                '-i', '/etc/default/grub',
-                ], env=self.create_chroot_env())
-
     def adjust_grub_defaults(self, with_openstack):
-        if with_openstack:
-            self._disable_grub2_gfxmode()
-            self._ensure_eth0_naming()
+        if not with_openstack:
+            return
+
+        # NOTE: Both edits must land before the engine appends the serial
+        #       console to GRUB_CMDLINE_LINUX right after this call, so
+        #       they cannot be deferred any further; one in-process
+        #       read-modify-write covers them without entering the chroot
+        etc_default_grub = os.path.join(self._abs_mountpoint,
+                'etc/default/grub')
+        with open(etc_default_grub) as f:
+            content = f.read()
+
+        content = _GRUB_TERMINAL_LINE.sub(
+                'GRUB_TERMINAL=console  # forced by image-bootstrap', content)
+        content = _GRUB_CMDLINE_COMMENTED.sub(
+                'GRUB_CMDLINE_LINUX="net.ifnames=0"  # set by image-bootstrap',
+                content)
+
+        with open(etc_default_grub, 'w') as f:
+            f.write(content)
 
     def generate_grub_cfg_from_inside_chroot(self):
+        # grub-mkconfig probes every block device and scans /boot; skip it
+        # when a config from this run is already newer than the defaults
+        # (a fresh image never has one, so this only fires on re-runs)
+        abs_etc_default_grub = os.path.join(self._abs_mountpoint,
+                'etc/default/grub')
+        abs_grub_cfg = os.path.join(self._abs_mountpoint,
+                'boot/grub/grub.cfg')
+        try:
+            if (os.path.getmtime(abs_grub_cfg)
+                    >= os.path.getmtime(abs_etc_default_grub)):
+                self._messenger.info(
+                        'GRUB configuration is up to date, not re-generating.')
+                return
+        except OSError:
+            pass
+
         cmd = [
                 COMMAND_CHROOT,
                 self._abs_mountpoint,
                 'grub-mkconfig',
                 '-o', '/boot/grub/grub.cfg',
                 ]
-        self._executor.check_call(cmd, env=self.create_chroot_env())
+        self._executor.check_call(cmd, env=self.get_chroot_env())
+
+    def _list_boot_files(self, prefix, suffix=''):
+        with os.scandir(os.path.join(self._abs_mountpoint, 'boot')) as it:
+            return [e.name for e in it
+                    if e.name.startswith(prefix) and e.name.endswith(suffix)]
 
     def _get_installed_kernel_version(self):
+        if self._installed_kernel_version is not None:
+            return self._installed_kernel_version
+
         prefix = 'vmlinuz-'
-        kernel_bins = [os.path.basename(e) for e
-                in sorted(glob.glob(os.path.join(self._abs_mountpoint, 'boot/%s*' % prefix)))]
+        kernel_bins = self._list_boot_files(prefix)
         if not kernel_bins:
             raise ValueError('No kernel binary found')  # TODO proper exception
 
-        kernel_version = kernel_bins[-1][len(prefix):]
+        kernel_version = max(kernel_bins, key=_version_sort_key)[len(prefix):]
         if len(kernel_bins) > 1:
             self._messenger.warn('Multiple kernel binaries found, picked "%s-%s" for version extraction' % (prefix, kernel_version))
 
+        self._installed_kernel_version = kernel_version
         return kernel_version
 
     def _make_initramfs_symlink(self):
         # NOTE: dracut default is /boot/initramfs-<kernel version>.img
-        initramfs_images = [os.path.basename(e) for e
-                in sorted(glob.glob(os.path.join(self._abs_mountpoint, 'boot/initramfs-*.img')))]
+        initramfs_images = self._list_boot_files('initramfs-', '.img')
         if not initramfs_images:
             raise ValueError('No initramfs image found')  # TODO proper exception
 
-        target_basename = initramfs_images[-1]
+        target_basename = max(initramfs_images, key=_version_sort_key)
         if len(initramfs_images) > 1:
             self._messenger.warn('Multiple initramfs images found, picked "%s" for the symlink' % target_basename)
 
@@ -246,7 +398,7 @@ class GentooStrategy(DistroStrategy):
                 self._abs_mountpoint,
                 'dracut',
                 '--kver', kernel_version_str,
-                ], env=self.create_chroot_env())
+                ], env=self.get_chroot_env())
 
         self._make_initramfs_symlink()
 
@@ -257,11 +409,7 @@ class GentooStrategy(DistroStrategy):
         return '/etc/cloud/cloud.cfg.d/90_datasource.cfg'
 
     def get_commands_to_check_for(self):
-        return GentooBootstrapper.get_commands_to_check_for() + [
-                COMMAND_CHROOT,
-                COMMAND_FIND,
-                COMMAND_WGET,
-                ]
+        return list(self._COMMANDS_TO_CHECK_FOR)
 
     def get_initramfs_path(self):
         return '/boot/initramfs'
@@ -284,34 +432,15 @@ class GentooStrategy(DistroStrategy):
         self._install_package_atoms(['net-misc/openssh'])
 
         init_script_path = os.path.join(self._abs_mountpoint, 'etc/init.d/sshd-need-root')
-        with open(init_script_path, 'w') as f:
-            print(dedent("""\
-                    #!/sbin/runscript
-                    # Workaround to ensure that sshd has a writable root file system
-                    # during key generation
-                    # https://bugs.gentoo.org/show_bug.cgi?id=554804
-                    #
-                    # Copyright (C) 2015 Sebastian Pipping <sebastian@pipping.org>
-                    # Licensed under AGPL v3 or later
-
-                    depend() {
-                        if ! ls /etc/ssh/ssh_host_*_key 1>/dev/null 2>/dev/null; then
-                            need root
-                        fi
-                        before sshd
-                    }
-
-                    start() { :; }
-                    stop() { :; }
-                    """), file=f)
-            os.fchmod(f.fileno(), 0o755)
+        write_file(init_script_path, _SSHD_NEED_ROOT_CONTENT.encode('utf-8'),
+                mode=0o755)
 
     def install_dhcp_client(self):
-        self._install_package_atoms(['net-misc/dhcpcd'])
+        self._queue_package_atoms(['net-misc/dhcpcd'])
 
     def install_sudo(self):
         self._set_package_use_flags('app-admin/sudo', '-sendmail')
-        self._install_package_atoms(['app-admin/sudo'])
+        self._queue_package_atoms(['app-admin/sudo'])
 
     def _create_network_init_script_symlink(self, interface_name):
         net_service = 'net.%s' % interface_name
@@ -320,12 +449,16 @@ class GentooStrategy(DistroStrategy):
         return net_service
 
     def _make_service_autostart(self, service_name):
-        self._executor.check_call([
-            COMMAND_CHROOT,
-            self._abs_mountpoint,
-            'rc-update',
-            'add', service_name, 'default',
-            ], env=self.create_chroot_env())
+        # What "rc-update add <service> default" would do, minus the
+        # chroot + fork: symlink the init script into the runlevel
+        abs_runlevel_dir = os.path.join(self._abs_mountpoint,
+                'etc/runlevels/default')
+        os.makedirs(abs_runlevel_dir, 0o755, exist_ok=True)
+        try:
+            os.symlink('/etc/init.d/%s' % service_name,
+                    os.path.join(abs_runlevel_dir, service_name))
+        except FileExistsError:
+            pass
 
     def make_openstack_services_autostart(self):
         net_service = self._create_network_init_script_symlink('eth0')
@@ -342,11 +475,25 @@ class GentooStrategy(DistroStrategy):
             self._make_service_autostart(service)
 
     def _mark_all_news_as_read(self):
+        # Skip the chroot + eselect (a bash script) when no news is unread
+        abs_news_dir = os.path.join(self._abs_mountpoint,
+                'var/lib/gentoo/news')
+        try:
+            with os.scandir(abs_news_dir) as it:
+                any_unread = any(entry.name.endswith('.unread')
+                        and entry.stat().st_size > 0
+                        for entry in it)
+        except FileNotFoundError:
+            any_unread = False
+
+        if not any_unread:
+            return
+
         self._executor.check_call([
             COMMAND_CHROOT, self._abs_mountpoint,
             'eselect', 'news',
             'read', '--quiet', 'all',
-            ], env=self.create_chroot_env())
+            ], env=self.get_chroot_env())
 
     def perform_in_chroot_shipping_clean_up(self):
         self._mark_all_news_as_read()
@@ -354,13 +501,14 @@ class GentooStrategy(DistroStrategy):
     def _clean_distfiles(self):
         distfiles_abs_path = os.path.join(self._abs_mountpoint, 'var/cache/distfiles')
         self._messenger.info('Cleaning distfiles at "%s"...' % distfiles_abs_path)
-        cmd = [
-                COMMAND_FIND,
-                distfiles_abs_path,
-                '-type', 'f',
-                '-delete',
-                ]
-        self._executor.check_call(cmd)
+        # In-process twin of "find .. -type f -delete": removes regular
+        # files only, keeps any directory structure
+        for root, dirs, files in os.walk(distfiles_abs_path):
+            for basename in files:
+                try:
+                    os.unlink(os.path.join(root, basename))
+                except FileNotFoundError:
+                    pass
 
     def perform_post_chroot_clean_up(self):
         self._clean_distfiles()
@@ -384,71 +532,39 @@ class GentooStrategy(DistroStrategy):
         bootstrap.run()
 
     def prepare_installation_of_packages(self):
-        for chroot_abs_path in (
-                _ABS_PACKAGE_KEYWORDS,
-                _ABS_PACKAGE_MASK,
-                _ABS_PACKAGE_UNMASK,
-                _ABS_PACKAGE_USE,
+        # Anchor the portage config directories to the mountpoint once;
+        # the per-package helpers only join the file name from here on
+        self._abs_package_use_dir = os.path.join(
+                self._abs_mountpoint, _ABS_PACKAGE_USE.lstrip('/'))
+        self._abs_package_keywords_dir = os.path.join(
+                self._abs_mountpoint, _ABS_PACKAGE_KEYWORDS.lstrip('/'))
+        self._abs_package_mask_dir = os.path.join(
+                self._abs_mountpoint, _ABS_PACKAGE_MASK.lstrip('/'))
+        self._abs_package_unmask_dir = os.path.join(
+                self._abs_mountpoint, _ABS_PACKAGE_UNMASK.lstrip('/'))
+
+        for abs_dir in (
+                self._abs_package_keywords_dir,
+                self._abs_package_mask_dir,
+                self._abs_package_unmask_dir,
+                self._abs_package_use_dir,
                 ):
-            try:
-                os.makedirs(os.path.join(self._abs_mountpoint, chroot_abs_path.lstrip('/')), 0o755)
-            except OSError as e:
-                if e.errno != errno.EEXIST:
-                    raise
+            os.makedirs(abs_dir, 0o755, exist_ok=True)
 
-    def _enable_kernel_option(self, option_name):
-        self._executor.check_call([
+    def _enable_kernel_options(self, option_names):
+        # scripts/config applies repeated --enable flags left to right,
+        # so one chroot invocation covers the whole batch
+        argv = [
                 COMMAND_CHROOT, self._abs_mountpoint,
                 '/usr/src/linux/scripts/config',
                 '--file', '/usr/src/linux/.config',
-                '--enable', option_name,
-                ], env=self.create_chroot_env())
+                ]
+        for option_name in option_names:
+            argv += ['--enable', option_name]
+        self._executor.check_call(argv, env=self.get_chroot_env())
 
     def _configure_kernel__enable_kvm_support(self):
-        tasks = dedent("""\
-                # Based on https://git.kernel.org/pub/scm/linux/kernel/git/stable/linux.git/tree/kernel/configs/kvm_guest.config?h=v5.17.3
-                CONFIG_NET=y
-                CONFIG_NET_CORE=y
-                CONFIG_NETDEVICES=y
-                CONFIG_BLOCK=y
-                CONFIG_BLK_DEV=y
-                CONFIG_NETWORK_FILESYSTEMS=y
-                CONFIG_INET=y
-                CONFIG_TTY=y
-                CONFIG_SERIAL_8250=y
-                CONFIG_SERIAL_8250_CONSOLE=y
-                CONFIG_IP_PNP=y
-                CONFIG_IP_PNP_DHCP=y
-                CONFIG_BINFMT_ELF=y
-                CONFIG_PCI=y
-                CONFIG_PCI_MSI=y
-                # CONFIG_DEBUG_KERNEL=y
-                CONFIG_VIRTUALIZATION=y
-                CONFIG_HYPERVISOR_GUEST=y
-                CONFIG_PARAVIRT=y
-                CONFIG_KVM_GUEST=y
-                CONFIG_VIRTIO=y
-                CONFIG_VIRTIO_MENU=y
-                CONFIG_VIRTIO_PCI=y
-                CONFIG_VIRTIO_BLK=y
-                CONFIG_VIRTIO_CONSOLE=y
-                CONFIG_VIRTIO_NET=y
-                CONFIG_9P_FS=y
-                CONFIG_NET_9P=y
-                CONFIG_NET_9P_VIRTIO=y
-                CONFIG_SCSI_LOWLEVEL=y
-                CONFIG_SCSI_VIRTIO=y
-                CONFIG_VIRTIO_INPUT=y
-                CONFIG_DRM_VIRTIO_GPU=y
-                """)
-        for line in tasks.split('\n'):
-            if not line or line.startswith('#'):
-                continue
-            assert line.startswith('CONFIG_')
-            assert line.endswith('=y')
-            option_name = line[len('CONFIG_'):-len('=y')]
-
-            self._enable_kernel_option(option_name)
+        self._enable_kernel_options(_KVM_KERNEL_OPTIONS)
 
     def _configure_kernel__finish(self):
         self._executor.check_call([
@@ -456,14 +572,14 @@ class GentooStrategy(DistroStrategy):
                 'make',
                 '-C', '/usr/src/linux',
                 'olddefconfig',
-                ], env=self.create_chroot_env())
+                ], env=self.get_chroot_env())
         self._executor.check_call([
                 COMMAND_CHROOT, self._abs_mountpoint,
                 '/usr/src/linux/scripts/diffconfig',
                 '-m',
                 '/usr/src/linux/.config.initial',
                 '/usr/src/linux/.config',
-                ], env=self.create_chroot_env())
+                ], env=self.get_chroot_env())
 
     def install_kernel(self):
         self._set_package_keywords('sys-kernel/vanilla-sources', f'~{_HOST_ARCH}')
@@ -472,11 +588,17 @@ class GentooStrategy(DistroStrategy):
         self._executor.check_call([
                 COMMAND_CHROOT, self._abs_mountpoint,
                 'make', '-C', '/usr/src/linux', 'defconfig',
-                ], env=self.create_chroot_env())
-        shutil.copyfile(
-                os.path.join(self._abs_mountpoint, 'usr/src/linux/.config'),
-                os.path.join(self._abs_mountpoint, 'usr/src/linux/.config.initial'),
-                )
+                ], env=self.get_chroot_env())
+        # The snapshot only feeds diffconfig later and make replaces
+        # .config by rename rather than truncation, so a hardlink is as
+        # good as a copy; fall back for file systems without hardlinks
+        abs_config = os.path.join(self._abs_mountpoint, 'usr/src/linux/.config')
+        abs_config_initial = os.path.join(
+                self._abs_mountpoint, 'usr/src/linux/.config.initial')
+        try:
+            os.link(abs_config, abs_config_initial)
+        except OSError:
+            shutil.copyfile(abs_config, abs_config_initial)
 
         self._configure_kernel__enable_kvm_support()
         self._configure_kernel__finish()
@@ -485,22 +607,24 @@ class GentooStrategy(DistroStrategy):
                 COMMAND_CHROOT, self._abs_mountpoint,
                 'make',
                 '-C', '/usr/src/linux',
-                '-j2',
-                ], env=self.create_chroot_env())
+                '-j%d' % _JOB_COUNT,
+                ], env=self.get_chroot_env())
         self._executor.check_call([
                 COMMAND_CHROOT, self._abs_mountpoint,
                 'ln', '-s', 'MISSING', '/boot/vmlinuz',
-                ], env=self.create_chroot_env())
+                ], env=self.get_chroot_env())
         self._executor.check_call([
                 COMMAND_CHROOT, self._abs_mountpoint,
                 'make',
                 '-C', '/usr/src/linux',
                 'modules_install', 'install', 'clean',
-                ], env=self.create_chroot_env())
+                ], env=self.get_chroot_env())
         self._executor.check_call([
                 COMMAND_CHROOT, self._abs_mountpoint,
                 'rm', '-f', '/boot/vmlinuz.old',
-                ], env=self.create_chroot_env())
+                ], env=self.get_chroot_env())
+
+        self._installed_kernel_version = None  # /boot just changed
 
     def uses_systemd(self):
         return False
@@ -4,24 +4,31 @@
 
 
 import errno
+import fcntl
 import os
 import pwd
+import re
+import shutil
 import stat
 import subprocess
 import tempfile
 import time
-from contextlib import suppress
+from concurrent.futures import ThreadPoolExecutor
+from ctypes import CDLL, c_char_p, c_void_p
 from textwrap import dedent
 
 from directory_bootstrap.shared.byte_size import format_byte_size
+from directory_bootstrap.shared.file_writing import (
+        write_file, write_file_atomically)
 from directory_bootstrap.shared.commands import (
-        COMMAND_BLKID, COMMAND_BLOCKDEV, COMMAND_CHMOD, COMMAND_CHROOT,
-        COMMAND_CP, COMMAND_EXTLINUX, COMMAND_FIND, COMMAND_INSTALL_MBR,
-        COMMAND_KPARTX, COMMAND_MKDIR, COMMAND_MKFS_EXT4, COMMAND_MOUNT,
-        COMMAND_PARTED, COMMAND_PARTPROBE, COMMAND_RM, COMMAND_RMDIR,
-        COMMAND_SED, COMMAND_TUNE2FS, EXIT_COMMAND_NOT_FOUND,
-        check_call__keep_trying, check_for_commands, find_command)
-from directory_bootstrap.shared.mount import COMMAND_UMOUNT, try_unmounting
+        COMMAND_BLKID, COMMAND_BLOCKDEV, COMMAND_CHROOT, COMMAND_EXTLINUX,
+        COMMAND_FIND, COMMAND_INSTALL_MBR, COMMAND_KPARTX, COMMAND_MKFS_EXT4,
+        COMMAND_MOUNT, COMMAND_PARTED, COMMAND_PARTPROBE, COMMAND_TUNE2FS,
+        COMMAND_UDEVADM, EXIT_COMMAND_NOT_FOUND, check_call__keep_trying,
+        check_for_commands, find_command)
+from directory_bootstrap.shared.mount import (
+        COMMAND_UMOUNT, try_mounting_in_process, try_unmounting,
+        try_unmounting_lazily_in_process)
 from directory_bootstrap.shared.namespace import (
         set_hostname, unshare_current_process)
 from directory_bootstrap.shared.resolv_conf import filter_copy_resolv_conf
@@ -53,18 +60,45 @@ _MOUNTPOINT_PARENT_DIR = '/mnt'
 _CHROOT_SCRIPT_TARGET_DIR = 'root/chroot-scripts/'
 
 _NON_DISK_MOUNT_TASKS = (
-        ('devtmpfs', ['-t', 'devtmpfs'], 'dev'),
-        ('devpts', ['-t', 'devpts'], 'dev/pts'),
-        ('tmpfs', ['-t', 'tmpfs', '-o', 'mode=1777'], 'dev/shm'),
-        ('proc', ['-t', 'proc'], 'proc'),
-        ('sysfs', ['-t', 'sysfs'], 'sys'),
+        ('devtmpfs', 'devtmpfs', None, 'dev'),
+        ('devpts', 'devpts', None, 'dev/pts'),
+        ('tmpfs', 'tmpfs', 'mode=1777', 'dev/shm'),
+        ('proc', 'proc', None, 'proc'),
+        ('sysfs', 'sysfs', None, 'sys'),
         )
 
 _DISK_ID_OFFSET = 440
 _DISK_ID_COUNT_BYTES = 4
 
+_BLKRRPART = 0x125f  # <linux/fs.h>
+
 _CONSOLE_CONFIG = 'console=tty0 console=ttyS0,115200'
 
+_GRUB_CFG_ROOT_RE = re.compile(rb'root=[^ ]+')
+
+
+def _read_uuid_from_libblkid(abs_device):
+    """
+    Reads the file system UUID using libblkid, in-process;
+    returns None where that does not work out
+    (so that the caller can fall back to running blkid)
+    """
+    try:
+        libblkid = CDLL('libblkid.so.1')
+    except OSError:
+        return None
+
+    libblkid.blkid_get_tag_value.restype = c_char_p
+    libblkid.blkid_get_tag_value.argtypes = [c_void_p, c_char_p, c_char_p]
+    # NOTE: ctypes copies the returned string; the malloc'd original is
+    #       leaked, which is fine for this once-per-run call
+    value = libblkid.blkid_get_tag_value(None, b'UUID',
+            abs_device.encode('utf-8'))
+    if value is None:
+        return None
+
+    return value.decode('utf-8')
+
 
 class _script_filename_telling_exceptions(object):
     """
@@ -116,6 +150,7 @@ class BootstrapEngine(object):
             abs_scripts_dir_pre,
             abs_scripts_dir_chroot,
             abs_scripts_dir_post,
+            scripts_parallel,
             abs_target_path,
             command_grub2_install,
             ):
@@ -128,13 +163,19 @@ class BootstrapEngine(object):
         self._abs_scripts_dir_pre = abs_scripts_dir_pre
         self._abs_scripts_dir_chroot = abs_scripts_dir_chroot
         self._abs_scripts_dir_post = abs_scripts_dir_post
+        self._scripts_parallel = scripts_parallel
         self._abs_target_path = abs_target_path
 
         self._command_grub2_install = command_grub2_install
 
         self._abs_mountpoint = None
+        self._abs_mountpoint_etc = None
+        self._abs_chroot_scripts_target_dir = None
         self._abs_first_partition_device = None
 
+        self._chroot_script_basenames = None
+        self._environment_cache = {}
+
         self._distro = None
 
     def set_distro(self, distro):
@@ -155,20 +196,15 @@ class BootstrapEngine(object):
         res += [
                 COMMAND_BLKID,
                 COMMAND_BLOCKDEV,
-                COMMAND_CHMOD,
                 COMMAND_CHROOT,
-                COMMAND_CP,
                 COMMAND_FIND,
                 COMMAND_KPARTX,
-                COMMAND_MKDIR,
                 COMMAND_MKFS_EXT4,
                 COMMAND_MOUNT,
                 COMMAND_PARTED,
                 COMMAND_PARTPROBE,
-                COMMAND_RM,
-                COMMAND_RMDIR,
-                COMMAND_SED,
                 COMMAND_TUNE2FS,
+                COMMAND_UDEVADM,
                 COMMAND_UMOUNT,
                 self._command_grub2_install,
                 ]
@@ -233,11 +269,9 @@ class BootstrapEngine(object):
         assert self._config.architecture is not None
 
     def _script_should_be_run(self, basename):
-        if basename.startswith('.'):
-            return False
-        elif basename.endswith('~'):
-            return False
-        return True
+        # Slices rather than startswith/endswith: this predicate runs
+        # inside every directory-listing filter
+        return basename[:1] != '.' and basename[-1:] != '~'
 
     def check_script_permissions(self):
         infos_produced = False
@@ -251,6 +285,18 @@ class BootstrapEngine(object):
         else:
             good_uids.add(sudo_uid)
 
+        # One pwd lookup per owner candidate, not one per category;
+        # tolerate uids without a passwd entry (e.g. stripped containers)
+        def _describe_uid(uid):
+            try:
+                name = pwd.getpwuid(uid).pw_name
+            except KeyError:
+                name = '???'
+            return 'user %s/%d' % (name, uid)
+
+        user_info = ' or '.join(_describe_uid(uid)
+                for uid in sorted(good_uids))
+
         for category, abs_scripts_dir in (
                 ('pre-chroot', self._abs_scripts_dir_pre),
                 ('chroot', self._abs_scripts_dir_chroot),
@@ -273,19 +319,19 @@ class BootstrapEngine(object):
                 raise OSError(errno.EPERM, 'Directory "%s" is writable to users other than its owner' % abs_scripts_dir)
 
             if props.st_uid not in good_uids:
-                user_info = ' or '.join(('user %s/%d' % (pwd.getpwuid(uid).pw_name, uid) for uid in sorted(good_uids)))
                 raise OSError(errno.EPERM, 'Directory "%s" is not owned by %s' % (abs_scripts_dir, user_info))
 
             self._messenger.info('Checking %s scripts for executability...' % category)
             infos_produced = True
 
-            for basename in sorted(os.listdir(abs_scripts_dir)):
-                if not self._script_should_be_run(basename):
+            for entry in sorted(os.scandir(abs_scripts_dir), key=lambda e: e.name):
+                if not self._script_should_be_run(entry.name):
                     continue
 
-                abs_filename = os.path.join(abs_scripts_dir, basename)
-                if not os.access(abs_filename, os.X_OK):
-                    raise OSError(errno.EACCES, 'Permission denied, file "%s" not executable' % abs_filename)
+                # The DirEntry carries the mode bits already, so this works
+                # without a faccessat per script (we run as root anyway)
+                if not entry.stat().st_mode & 0o111:
+                    raise OSError(errno.EACCES, 'Permission denied, file "%s" not executable' % entry.path)
 
         if infos_produced:
             self._messenger.info_gap()
@@ -312,66 +358,78 @@ class BootstrapEngine(object):
 
     def _partition_device(self):
         self._messenger.info('Partitioning "%s"...' % self._abs_target_path)
-        cmd_mklabel = [
-                COMMAND_PARTED,
-                '--script',
-                self._abs_target_path,
-                'mklabel', 'msdos',
-                ]
-        self._executor.check_call(cmd_mklabel)
-
-        # Make existing partition devices leave
-        check_call__keep_trying(self._executor, [
-                COMMAND_PARTPROBE,
-                self._abs_target_path,
-                ])
-
-        cmd_mkpart = [
+        cmd_parted = [
                 COMMAND_PARTED,
                 '--script',
                 '--align', 'optimal',
                 self._abs_target_path,
-                'mkpart',
-                'primary', 'ext4', '1', '100%',
-                ]
-        self._executor.check_call(cmd_mkpart)
-
-        cmd_boot_flag = [
-                COMMAND_PARTED,
-                '--script',
-                self._abs_target_path,
+                'mklabel', 'msdos',
+                'mkpart', 'primary', 'ext4', '1', '100%',
                 'set', '1', 'boot', 'on',
                 ]
-        time.sleep(1)  # increase chances of first call working, e.g. with LVM volumes
-        check_call__keep_trying(self._executor, cmd_boot_flag)
+        self._executor.check_call(cmd_parted)
+        self._reread_partition_table()
+
+    def _reread_partition_table(self):
+        # Make stale partition devices leave and the new ones appear:
+        # the BLKRRPART ioctl asks the kernel directly and synchronously;
+        # partprobe stays as fallback for devices that refuse (e.g. EBUSY
+        # or partitions still held open)
+        try:
+            fd = os.open(self._abs_target_path, os.O_RDONLY)
+            try:
+                fcntl.ioctl(fd, _BLKRRPART)
+            finally:
+                os.close(fd)
+        except OSError:
+            check_call__keep_trying(self._executor, [
+                    COMMAND_PARTPROBE,
+                    self._abs_target_path,
+                    ])
+
+    @staticmethod
+    def _parse_kpartx_verbose_output(output):
+        # Verbose output lines read "add map loop0p1 (253:0): 0 1234 ...";
+        # "-u" may report "del map .." lines for stale mappings, too
+        for line in output.split(b'\n'):
+            words = line.split(b' ')
+            if len(words) >= 3 and words[0] == b'add' and words[1] == b'map':
+                return words[2].decode('utf-8')
+        return None
 
     def _create_partition_devices(self):
         self._messenger.info('Activating partition devices...')
-        cmd_list = [
-                COMMAND_KPARTX,
-                '-l',
-                self._abs_target_path,
-                ]
-        output = self._executor.check_output(cmd_list)
-        device_name = output.split(b'\n')[0].split(b' : ')[0].decode('utf-8')
-        self._abs_first_partition_device = '/dev/mapper/%s' % device_name
 
         # NOTE: Ubuntu 15.04 does not have "-u" (issue #30)
         #       So we try -u first, then -a if -u failed
         try:
-            self._executor.check_call([COMMAND_KPARTX,
-                    '-u', self._abs_target_path,
+            output = self._executor.check_output([COMMAND_KPARTX,
+                    '-u', '-s', '-v', self._abs_target_path,
                     ])
         except subprocess.CalledProcessError:
-            self._executor.check_call([COMMAND_KPARTX,
-                    '-a', self._abs_target_path,
+            output = self._executor.check_output([COMMAND_KPARTX,
+                    '-a', '-s', '-v', self._abs_target_path,
                     ])
 
-        for i in range(3):
-            if os.path.exists(self._abs_first_partition_device):
-                break
-            time.sleep(1)
-        else:
+        device_name = self._parse_kpartx_verbose_output(output)
+        if device_name is None:
+            # E.g. mappings were left behind by an earlier run;
+            # fall back to asking kpartx for the name
+            output = self._executor.check_output([COMMAND_KPARTX,
+                    '-l', self._abs_target_path,
+                    ])
+            device_name = output.split(b'\n')[0].split(b' : ')[0].decode('utf-8')
+
+        self._abs_first_partition_device = '/dev/mapper/%s' % device_name
+
+        # Wait for the uevent queue to drain rather than sleep-polling;
+        # returns as soon as the node exists, 3 seconds at worst
+        self._executor.check_call([COMMAND_UDEVADM, 'settle',
+                '--timeout=3',
+                '--exit-if-exists=%s' % self._abs_first_partition_device,
+                ])
+
+        if not os.path.exists(self._abs_first_partition_device):
             raise OSError(errno.ENOENT, "No such block device file: '%s'" \
                     % self._abs_first_partition_device)
 
@@ -400,18 +458,24 @@ class BootstrapEngine(object):
 
     def _mkdir_mountpount(self):
         self._abs_mountpoint = tempfile.mkdtemp(dir=_MOUNTPOINT_PARENT_DIR)
+        # Anchor frequently used paths once, right as the mountpoint is born
+        self._abs_mountpoint_etc = os.path.join(self._abs_mountpoint, 'etc')
+        self._abs_chroot_scripts_target_dir = os.path.join(
+                self._abs_mountpoint, _CHROOT_SCRIPT_TARGET_DIR)
         self._messenger.info('Creating directory "%s"...' % self._abs_mountpoint)
         self._distro.set_mountpoint(self._abs_mountpoint)
 
     def _mkdir_mountpount_etc(self):
-        abs_dir = os.path.join(self._abs_mountpoint, 'etc')
-        self._messenger.info('Creating directory "%s"...' % abs_dir)
-        os.mkdir(abs_dir, 0o755)
+        self._messenger.info('Creating directory "%s"...' % self._abs_mountpoint_etc)
+        os.mkdir(self._abs_mountpoint_etc, 0o755)
 
     def _mount_disk_chroot_mounts(self):
         self._messenger.info('Mounting partitions...')
         cmd = [
                 COMMAND_MOUNT,
+                # Nothing during the build needs access times, and package
+                # installation touches tens of thousands of inodes
+                '-o', 'noatime',
                 self._abs_first_partition_device,
                 self._abs_mountpoint,
                 ]
@@ -427,7 +491,8 @@ class BootstrapEngine(object):
         mounts = MountFinder()
         mounts.load()
         for abs_mount_point in reversed(list(mounts.below(self._abs_mountpoint))):
-            self._try_unmounting(abs_mount_point)
+            if not try_unmounting_lazily_in_process(abs_mount_point):
+                self._try_unmounting(abs_mount_point)
 
     def _set_root_password_inside_chroot(self):
         self._messenger.info('Setting root password...')
@@ -442,9 +507,8 @@ class BootstrapEngine(object):
         env = self.make_environment(tell_mountpoint=False)
         self._messenger.announce_command(cmd)
         p = subprocess.Popen(cmd, stdin=subprocess.PIPE, env=env)
-        p.stdin.write(('root:%s' % self._config.root_password).encode('utf-8'))
-        p.stdin.close()
-        p.wait()
+        p.communicate(
+                input=('root:%s' % self._config.root_password).encode('utf-8'))
         if p.returncode:
             raise subprocess.CalledProcessError(p.returncode, cmd)
 
@@ -460,30 +524,33 @@ class BootstrapEngine(object):
         self._executor.check_call(cmd)
 
     def _gather_first_partition_uuid(self):
-        cmd_blkid = [
-                COMMAND_BLKID,
-                '-o', 'value',
-                '-s', 'UUID',
-                self._abs_first_partition_device,
-                ]
-        output = self._executor.check_output(cmd_blkid)
-        first_partition_uuid = output.rstrip().decode('utf-8')
+        first_partition_uuid = _read_uuid_from_libblkid(
+                self._abs_first_partition_device)
+        if first_partition_uuid is None:
+            cmd_blkid = [
+                    COMMAND_BLKID,
+                    '-o', 'value',
+                    '-s', 'UUID',
+                    self._abs_first_partition_device,
+                    ]
+            output = self._executor.check_output(cmd_blkid)
+            first_partition_uuid = output.rstrip().decode('utf-8')
         require_valid_uuid(first_partition_uuid)
         self._config.first_partition_uuid = first_partition_uuid
 
     def _create_etc_fstab(self):
-        filename = os.path.join(self._abs_mountpoint, 'etc', 'fstab')
+        filename = os.path.join(self._abs_mountpoint_etc, 'fstab')
         self._messenger.info('Writing file "%s"...' % filename)
-        f = open(filename, 'w')
-        print('/dev/disk/by-uuid/%s / auto defaults 0 1' % self._config.first_partition_uuid, file=f)
-        f.close()
+        write_file_atomically(filename,
+                ('/dev/disk/by-uuid/%s / auto defaults 0 1\n'
+                        % self._config.first_partition_uuid).encode('utf-8'))
 
     def _create_etc_machine_id(self):
         if self._config.machine_id:
             etc_machine_id = os.path.join(self._abs_mountpoint, 'etc/machine-id')
             self._messenger.info('Writing file "%s"...' % etc_machine_id)
-            with open(etc_machine_id, 'w') as f:
-                print(self._config.machine_id, file=f)
+            write_file(etc_machine_id,
+                    ('%s\n' % self._config.machine_id).encode('utf-8'))
 
     def _configure_hostname(self):
         self._distro.configure_hostname(self._config.hostname)
@@ -494,24 +561,47 @@ class BootstrapEngine(object):
 
     def _fix_grub_cfg_root_device(self):
         self._messenger.info('Post-processing GRUB config...')
-        cmd_sed = [
-                COMMAND_SED,
-                r's,root=[^ ]\+,root=UUID=%s,g' % self._config.first_partition_uuid,
-                '-i', os.path.join(self._abs_mountpoint, 'boot', 'grub', 'grub.cfg'),
-                ]
-        self._executor.check_call(cmd_sed)
+        abs_grub_cfg = os.path.join(self._abs_mountpoint, 'boot', 'grub', 'grub.cfg')
+        with open(abs_grub_cfg, 'rb') as f:
+            content = f.read()
 
-    def _run_scripts_from(self, abs_scripts_dir, env):
-        for basename in sorted(os.listdir(abs_scripts_dir)):
-            if not self._script_should_be_run(basename):
-                continue
+        content = _GRUB_CFG_ROOT_RE.sub(
+                b'root=UUID=' + self._config.first_partition_uuid.encode('ascii'),
+                content)
 
-            abs_script_filename = os.path.join(abs_scripts_dir, basename)
-            cmd = [abs_script_filename]
-            with _script_filename_telling_exceptions(abs_script_filename):
-                self._executor.check_call(cmd, env=env.copy())
+        abs_grub_cfg_tmp = abs_grub_cfg + '.tmp'
+        with open(abs_grub_cfg_tmp, 'wb') as f:
+            f.write(content)
+        os.replace(abs_grub_cfg_tmp, abs_grub_cfg)
+
+    def _run_script(self, abs_script_filename, env):
+        cmd = [abs_script_filename]
+        with _script_filename_telling_exceptions(abs_script_filename):
+            self._executor.check_call(cmd, env=env)
+
+    def _run_scripts_from(self, abs_scripts_dir, env):
+        abs_script_filenames = [entry.path
+                for entry in sorted(os.scandir(abs_scripts_dir), key=lambda e: e.name)
+                if self._script_should_be_run(entry.name)]
+
+        if self._scripts_parallel and len(abs_script_filenames) > 1:
+            with ThreadPoolExecutor(
+                    max_workers=min(8, len(abs_script_filenames))) as pool:
+                futures = [pool.submit(self._run_script, abs_script_filename, env)
+                        for abs_script_filename in abs_script_filenames]
+                for future in futures:
+                    future.result()  # re-raises, first failure first
+        else:
+            for abs_script_filename in abs_script_filenames:
+                self._run_script(abs_script_filename, env)
 
     def make_environment(self, tell_mountpoint):
+        # Built once per variant; subprocess snapshots the environment on
+        # exec, so handing out the shared dict is safe for read-only use
+        env = self._environment_cache.get(tell_mountpoint)
+        if env is not None:
+            return env
+
         env = os.environ.copy()
         for key in ('LANG', 'LANGUAGE', 'TMPDIR'):
             env.pop(key, None)
@@ -530,6 +620,7 @@ class BootstrapEngine(object):
                     'MNTPOINT': self._abs_mountpoint,  # for compatibility to grml-debootstrap
                     })
 
+        self._environment_cache[tell_mountpoint] = env
         return env
 
     def _run_pre_scripts(self):
@@ -540,14 +631,19 @@ class BootstrapEngine(object):
 
     def _mount_nondisk_chroot_mounts(self):
         self._messenger.info('Mounting non-disk file systems...')
-        for source, options, target in _NON_DISK_MOUNT_TASKS:
+        for source, fstype, options, target in _NON_DISK_MOUNT_TASKS:
+            abs_target = os.path.join(self._abs_mountpoint, target)
+            if try_mounting_in_process(source, abs_target, fstype, options):
+                continue
+
             cmd = [
                     COMMAND_MOUNT,
                     source,
+                    '-t', fstype,
                     ] \
-                    + options \
+                    + (['-o', options] if options else []) \
                     + [
-                        os.path.join(self._abs_mountpoint, target),
+                        abs_target,
                     ]
             self._executor.check_call(cmd)
 
@@ -571,7 +667,7 @@ class BootstrapEngine(object):
         boot_extlinux = os.path.join(self._abs_mountpoint, 'boot/extlinux/')
         extlinux_conf = os.path.join(boot_extlinux, 'extlinux.conf')
 
-        os.makedirs(boot_extlinux)
+        os.makedirs(boot_extlinux, 0o755, exist_ok=True)
 
         self._messenger.info('Writing file "%s"...' % extlinux_conf)
         with open(extlinux_conf, 'w') as f:
@@ -642,45 +738,41 @@ class BootstrapEngine(object):
         self._messenger.info('Generating initramfs...')
         return self._distro.generate_initramfs_from_inside_chroot()
 
+    def _get_chroot_script_basenames(self):
+        # The directory is static during a run, so one filtered listing
+        # serves the copy, run and remove passes alike
+        if self._chroot_script_basenames is None:
+            self._chroot_script_basenames = sorted(basename
+                    for basename in os.listdir(self._abs_scripts_dir_chroot)
+                    if self._script_should_be_run(basename))
+        return self._chroot_script_basenames
+
     def _create_etc_resolv_conf(self):
-        output_filename = os.path.join(self._abs_mountpoint, 'etc', 'resolv.conf')
+        output_filename = os.path.join(self._abs_mountpoint_etc, 'resolv.conf')
 
         filter_copy_resolv_conf(self._messenger, self._config.abs_etc_resolv_conf, output_filename)
 
     def _copy_chroot_scripts(self):
         self._messenger.info('Copying chroot scripts into chroot...')
-        abs_path_parent = os.path.join(self._abs_mountpoint, _CHROOT_SCRIPT_TARGET_DIR)
-        cmd_mkdir = [
-                COMMAND_MKDIR,
-                abs_path_parent,
-                ]
-        self._executor.check_call(cmd_mkdir)
-        for basename in os.listdir(self._abs_scripts_dir_chroot):
-            if not self._script_should_be_run(basename):
-                continue
+        abs_path_parent = self._abs_chroot_scripts_target_dir
+        os.makedirs(abs_path_parent, 0o755)
 
+        def copy_script(basename):
             abs_path_source = os.path.join(self._abs_scripts_dir_chroot, basename)
-            abs_path_target = os.path.join(self._abs_mountpoint, _CHROOT_SCRIPT_TARGET_DIR, basename)
-            cmd_copy = [
-                    COMMAND_CP,
-                    abs_path_source,
-                    abs_path_target,
-                    ]
-            self._executor.check_call(cmd_copy)
-            cmd_chmod = [
-                    COMMAND_CHMOD,
-                    'a+x',
-                    abs_path_target,
-                    ]
-            self._executor.check_call(cmd_chmod)
+            abs_path_target = os.path.join(abs_path_parent, basename)
+            shutil.copy(abs_path_source, abs_path_target)
+            os.chmod(abs_path_target, 0o755)
+
+        basenames = self._get_chroot_script_basenames()
+        if basenames:
+            with ThreadPoolExecutor(max_workers=min(8, len(basenames))) as pool:
+                for _ in pool.map(copy_script, basenames):
+                    pass
 
     def _run_chroot_scripts(self):
         self._messenger.info('Running chroot scripts...')
         env = self.make_environment(tell_mountpoint=False)
-        for basename in sorted(os.listdir(self._abs_scripts_dir_chroot)):
-            if not self._script_should_be_run(basename):
-                continue
-
+        for basename in self._get_chroot_script_basenames():
             abs_script_filename = os.path.join(
                     self._abs_scripts_dir_chroot, basename)
             cmd_run = [
@@ -689,36 +781,25 @@ class BootstrapEngine(object):
                     os.path.join('/', _CHROOT_SCRIPT_TARGET_DIR, basename),
                     ]
             with _script_filename_telling_exceptions(abs_script_filename):
-                self._executor.check_call(cmd_run, env=env.copy())
+                self._executor.check_call(cmd_run, env=env)
 
     def _remove_chroot_scripts(self):
         self._messenger.info('Removing chroot scripts...')
-        for basename in os.listdir(self._abs_scripts_dir_chroot):
-            if not self._script_should_be_run(basename):
-                continue
+        for basename in self._get_chroot_script_basenames():
+            os.unlink(os.path.join(
+                    self._abs_chroot_scripts_target_dir, basename))
 
-            abs_path_target = os.path.join(self._abs_mountpoint, _CHROOT_SCRIPT_TARGET_DIR, basename)
-            cmd_rm = [
-                    COMMAND_RM,
-                    abs_path_target,
-                    ]
-            self._executor.check_call(cmd_rm)
-
-        abs_path_parent = os.path.join(self._abs_mountpoint, _CHROOT_SCRIPT_TARGET_DIR)
-        cmd_rmdir = [
-                COMMAND_RMDIR,
-                abs_path_parent,
-                ]
-        self._executor.check_call(cmd_rmdir)
+        os.rmdir(self._abs_chroot_scripts_target_dir)
 
     def _try_unmounting(self, abs_path):
         return try_unmounting(self._executor, abs_path)
 
     def _unmount_nondisk_chroot_mounts(self):
         self._messenger.info('Unmounting non-disk file systems...')
-        for source, options, target in reversed(_NON_DISK_MOUNT_TASKS):
+        for source, fstype, options, target in reversed(_NON_DISK_MOUNT_TASKS):
             abs_path = os.path.join(self._abs_mountpoint, target)
-            self._try_unmounting(abs_path)
+            if not try_unmounting_lazily_in_process(abs_path):
+                self._try_unmounting(abs_path)
 
     def _perform_in_chroot_shipping_clean_up(self):
         self._distro.perform_in_chroot_shipping_clean_up()
@@ -734,6 +815,9 @@ class BootstrapEngine(object):
 
     def _unmount_disk_chroot_mounts(self):
         self._messenger.info('Unmounting partitions...')
+        # Sweep anything still mounted below first, e.g. a persistent
+        # cache bind mount left behind by an aborted run
+        self._unmount_directory_bootstrap_leftovers()
         self._try_unmounting(self._abs_mountpoint)
 
     def _remove_partition_devices(self):
@@ -750,6 +834,8 @@ class BootstrapEngine(object):
         for i in range(3):
             try:
                 os.rmdir(self._abs_mountpoint)
+            except FileNotFoundError:
+                break
             except OSError as e:
                 if e.errno != errno.EBUSY:
                     raise
@@ -765,10 +851,11 @@ class BootstrapEngine(object):
         assert len(content) == _DISK_ID_COUNT_BYTES
 
         self._messenger.info('Setting MBR disk identifier to %s (4 bytes)...' % str(self._config.disk_id))
-        f = open(self._abs_target_path, 'w')
-        f.seek(_DISK_ID_OFFSET)
-        f.write(content)
-        f.close()
+        fd = os.open(self._abs_target_path, os.O_WRONLY)
+        try:
+            os.pwrite(fd, content, _DISK_ID_OFFSET)
+        finally:
+            os.close(fd)
 
     def process_root_password(self):
         if self._config.abs_root_password_file:
@@ -804,9 +891,9 @@ class BootstrapEngine(object):
 
         self._messenger.info('Allowing user "%s" to call sudo with no password...' % user_name)
         sudoers_path = os.path.join(self._abs_mountpoint, 'etc/sudoers.d/%s-nopasswd' % user_name)
-        with open(sudoers_path, 'w') as f:
-            print('%s ALL = NOPASSWD: ALL' % user_name, file=f)
-            os.fchmod(f.fileno(), 0o440)
+        write_file(sudoers_path,
+                ('%s ALL = NOPASSWD: ALL\n' % user_name).encode('utf-8'),
+                mode=0o440)
 
     def _install_cloud_init_and_friends(self):
         self._distro.install_cloud_init_and_friends()
@@ -817,11 +904,10 @@ class BootstrapEngine(object):
         cloud_cfg_d_file_path = os.path.join(self._abs_mountpoint,
                 self._distro.get_cloud_init_datasource_cfg_path().lstrip('/'))
         self._messenger.info('Writing file "%s"...' % cloud_cfg_d_file_path)
-        with open(cloud_cfg_d_file_path, 'w') as f:
-            print(dedent("""\
-                    # generated by image-bootstrap
-                    datasource_list: [ConfigDrive, NoCloud, OpenStack, Ec2]
-                    """), file=f)
+        write_file(cloud_cfg_d_file_path, (
+                '# generated by image-bootstrap\n'
+                'datasource_list: [ConfigDrive, NoCloud, OpenStack, Ec2]\n'
+                ).encode('utf-8'))
 
     def _install_sshd(self):
         return self._distro.install_sshd()
@@ -864,7 +950,7 @@ class BootstrapEngine(object):
     def _disable_clearing_tty1(self):
         noclear_file_path = os.path.join(self._abs_mountpoint, 'etc/systemd/system/getty@tty1.service.d/noclear.conf')
         self._messenger.info('Disabling clearing of tty1 (file "%s")...' % noclear_file_path)
-        os.makedirs(os.path.dirname(noclear_file_path), 0o755)
+        os.makedirs(os.path.dirname(noclear_file_path), 0o755, exist_ok=True)
         with open(noclear_file_path, 'w') as f:
             print(dedent("""\
                     [Service]
@@ -873,8 +959,7 @@ class BootstrapEngine(object):
 
     def _disable_pcspkr_autoloading(self):
         abs_modprobe_d = os.path.join(self._abs_mountpoint, 'etc/modprobe.d')
-        with suppress(FileExistsError):
-            os.mkdir(abs_modprobe_d, 0o755)
+        os.makedirs(abs_modprobe_d, 0o755, exist_ok=True)
 
         file_name = os.path.join(abs_modprobe_d, 'pcspkr_no_autoload.conf')
         self._messenger.info('Disabling auto-loading of pcspkr kernel module...')
@@ -901,7 +986,7 @@ class BootstrapEngine(object):
 
     def _turn_etc_resolv_conf_to_systemd_resolved(self):
         self._messenger.info('Handing /etc/resolv.conf over to systemd-resolved...')
-        os.remove(os.path.join(self._abs_mountpoint, 'etc', 'resolv.conf'))
+        os.remove(os.path.join(self._abs_mountpoint_etc, 'resolv.conf'))
         env = self.make_environment(tell_mountpoint=False)
         self._executor.check_call([
                 COMMAND_CHROOT, self._abs_mountpoint,
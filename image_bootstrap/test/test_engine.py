@@ -0,0 +1,19 @@
+from unittest import TestCase
+
+from image_bootstrap.engine import BootstrapEngine
+
+
+class TestKpartxVerboseOutputParser(TestCase):
+
+    def test_first_mapping_wins(self):
+        output = (
+            b'add map loop0p1 (253:0): 0 20162560 linear 7:0 2048\n'
+            b'add map loop0p2 (253:1): 0 2048 linear 7:0 20164608\n'
+        )
+        self.assertEqual(
+                BootstrapEngine._parse_kpartx_verbose_output(output),
+                'loop0p1')
+
+    def test_empty_output(self):
+        self.assertIsNone(
+                BootstrapEngine._parse_kpartx_verbose_output(b''))
@@ -22,7 +22,7 @@ class DiskIdentifier(object):
         return '0x%8x' % self._number
 
     def byte_sequence(self):
-        return ''.join([chr((self._number >> i * 8) & 255) for i in range(4)])
+        return bytes(((self._number >> i * 8) & 255) for i in range(4))
 
 
 def disk_id_type(text):